@@ -1,155 +1,481 @@
 import os
 import sys
 import time
+import random
 import requests
 import argparse
 import logging
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Git-based integrations that AI-BOMs can be generated for
+SUPPORTED_INTEGRATION_TYPES = frozenset({'github', 'github-enterprise', 'gitlab', 'azure-repos', 'bitbucket-cloud'})
+
+# Number of targets whose AI-BOM jobs are processed at the same time
+DEFAULT_CONCURRENCY = 16
+
+# Bounds (in seconds) of the exponential backoff used while polling AI-BOM jobs
+POLL_INITIAL_DELAY = 0.25
+POLL_MAX_DELAY = 4.0
+
+
+# Size of the chunks the final AI-BOM is downloaded and searched in
+BOM_CHUNK_SIZE = 64 * 1024
+
+
+def parse_search_terms(search_keyword):
+    """
+    Splits comma-separated search keyword(s) into the terms matched against AI-BOMs.
+    
+    Empty terms (e.g. from a trailing comma) would match every BOM and repeated
+    terms would be searched for twice, so both are dropped.
+    
+    Returns:
+        list: The unique terms in order, UTF-8 encoded and ASCII-lowercased like the BOM bytes they are matched against.
+    """
+    terms = (term.strip().encode('utf-8').lower() for term in search_keyword.split(','))
+    return list(dict.fromkeys(term for term in terms if term))
+
+
+def _find_terms(chunks, terms):
+    """
+    Searches a stream of byte chunks for lowercased byte terms, ASCII case-insensitively.
+    
+    The tail of each chunk is carried over to the next one so terms spanning a
+    chunk boundary are still found. Reading stops once every term has been seen.
+    
+    Returns:
+        set: The terms that were found.
+    """
+    remaining = set(terms)
+    found = set()
+    overlap = max((len(term) for term in remaining), default=1) - 1
+    tail = b''
+    for chunk in chunks:
+        window = tail + chunk.lower()
+        for term in [term for term in remaining if window.find(term) != -1]:
+            remaining.discard(term)
+            found.add(term)
+        if not remaining:
+            break
+        tail = window[-overlap:] if overlap else b''
+    return found
+
+
+def _positive_int(value):
+    """argparse type for options that must be a positive integer."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid integer: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def _integration_type(target):
+    """Returns the integration type from a target's nested relationships, or None if it has none."""
+    try:
+        return target['relationships']['integration']['data']['attributes']['integration_type']
+    except (KeyError, TypeError):
+        # Missing (or null) somewhere along the way
+        return None
+
+
+def _parse_json(response):
+    """Parses a JSON:API response body with orjson, which is much faster than the stdlib parser."""
+    try:
+        return orjson.loads(response.content)
+    except orjson.JSONDecodeError as e:
+        # Surface it like response.json() does, so callers' RequestException handling still applies
+        raise requests.exceptions.RequestException(f"Invalid JSON in response: {e}", response=response) from e
+
+
+def _retry_after(response):
+    """Returns the server's Retry-After delay in seconds, or None if it didn't send one."""
+    value = response.headers.get('Retry-After')
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        # Missing, or an HTTP-date we don't bother parsing
+        return None
+
 
 class SnykAIBomScanner:
     """Snyk AI-BOM scanner client."""
     
-    def __init__(self, api_url, org_id, token, api_version='2025-07-22'):
-        self.api_url = api_url
+    def __init__(self, api_url, org_id, token, api_version='2025-07-22', concurrency=DEFAULT_CONCURRENCY):
+        self.api_url = api_url.rstrip('/')
         self.org_id = org_id
         self.api_version = api_version
+        
+        # Set when the target listing stopped early because a page couldn't be fetched
+        self.targets_incomplete = False
+        
+        # Endpoint URLs are fixed for the lifetime of the client, so build them once
+        self.org_url = f"{self.api_url}/rest/orgs/{self.org_id}"
+        self.ai_boms_url = f"{self.org_url}/ai_boms?version={self.api_version}"
         self.headers = {
             'Content-Type': 'application/vnd.api+json',
             'Authorization': f'token {token}'
         }
+        
+        # Reuse one pooled, keep-alive session for every API call
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        # Job creation is retried too: concurrent scans burst POSTs into the rate limit,
+        # and creating an AI-BOM job twice is harmless whereas dropping the target isn't
+        retries = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {'POST'},
+        )
+        # Keep a connection for every worker plus the thread paging through targets,
+        # otherwise connections beyond the pool size are discarded instead of kept alive
+        pool_size = max(concurrency + 1, 32)
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
     
-    def get_all_targets(self):
+    def close(self):
+        """Closes the underlying HTTP session and its pooled connections."""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def iter_all_targets(self):
         """
-        Fetches all targets from a Snyk organization, handling pagination.
+        Yields all supported targets from a Snyk organization page by page, handling pagination.
+        
+        Targets of a page are yielded before the next page is requested, so callers can
+        start working on them right away. Stops early if a page can't be fetched, in which
+        case targets_incomplete is set.
         """
-        targets = []
-        # Start with the first page URL, limiting to 100 results per page
-        url = f"{self.api_url}/rest/orgs/{self.org_id}/targets?version={self.api_version}&limit=100"
+        self.targets_incomplete = False
+        # Start with the first page URL, limiting to 100 results per page and letting
+        # the API drop targets of unsupported integrations (container images, CLI, ...)
+        source_types = ','.join(sorted(SUPPORTED_INTEGRATION_TYPES))
+        url = f"{self.org_url}/targets?version={self.api_version}&limit=100&source_types={source_types}"
         
         # Loop as long as there is a "next" page URL
         while url:
             try:
-                response = requests.get(url, headers=self.headers)
+                response = self.session.get(url)
                 response.raise_for_status() # Exit if there's an error
-                data = response.json()
-                
-                # Add the targets from the current page to our list
-                targets.extend(data.get('data', []))
-                
-                # Get the URL for the next page. If it doesn't exist, the loop will end.
-                next_link = data.get('links', {}).get('next')
-                if next_link:
-                    url = f"{self.api_url}{next_link}" # The link is relative, so add the base URL
-                    print(f"Fetching next page of targets...", file=sys.stderr)
-                else:
-                    url = None # End the loop
-
+                data = _parse_json(response)
             except requests.exceptions.RequestException as e:
                 print(f"Error fetching targets: {e}", file=sys.stderr)
-                return None
+                self.targets_incomplete = True
+                return
+            
+            # Hand out the targets from the current page
+            yield from data.get('data', [])
+            
+            # Get the URL for the next page. If it doesn't exist, the loop will end.
+            next_link = data.get('links', {}).get('next')
+            if next_link:
+                url = f"{self.api_url}{next_link}" # The link is relative, so add the base URL
+                print(f"Fetching next page of targets...", file=sys.stderr)
+            else:
+                url = None # End the loop
+
+    def get_all_targets(self):
+        """
+        Fetches all supported targets from a Snyk organization, handling pagination.
         
-        return targets
+        Returns:
+            list: The targets fetched. If a page couldn't be fetched this only holds the
+            targets listed before it (possibly none) and targets_incomplete is set.
+        """
+        return list(self.iter_all_targets())
 
-    def process_target(self, search_keyword, target):
+    def create_bom_job(self, target):
         """
-        Generates and searches an AI-BOM for a single target.
+        Creates the AI-BOM job for a single target.
         
         Returns:
-            list: List of matched search terms, or empty list if no matches found.
+            dict: The job to poll, or None if the target is incompatible or the job couldn't be created.
         """
         target_id = target['id']
         target_name = target['attributes'].get('display_name', 'Unknown Name')
         
-        print(f"Processing target {target_name}")
+        logging.info("Processing target %s", target_name)
 
-        # 1. Create the AI-BOM Job
         try:
-            post_url = f"{self.api_url}/rest/orgs/{self.org_id}/ai_boms?version={self.api_version}"
             payload = {
                 "data": {
                     "type": "ai_bom_scm_bundle",
                     "attributes": {"target_id": target_id}
                 }
             }
-            response = requests.post(post_url, headers=self.headers, json=payload)
+            response = self.session.post(self.ai_boms_url, data=orjson.dumps(payload))
             
             # Some targets might not be compatible; we'll skip them.
             if response.status_code == 422: # Unprocessable Entity
-                 logging.debug(f"Skipping '{target_name}': Incompatible target type.")
-                 return []
+                 logging.debug("Skipping '%s': Incompatible target type.", target_name)
+                 return None
 
             response.raise_for_status()
-            post_data = response.json()
-            logging.debug(f"  > Post data: {post_data}")
+            post_data = _parse_json(response)
+            logging.debug("  > Post data: %s", post_data)
 
             job_url = f"{self.api_url}{post_data['links']['self']}" # The URL to poll
 
             status = post_data['data']['attributes']['status']
-            logging.debug(f"  > Job created. Initial status: {status}")
+            logging.debug("  > Job created. Initial status: %s", status)
 
         except requests.exceptions.RequestException as e:
-            logging.debug(f"  > Error creating job for '{target_name}': {e}", file=sys.stderr)
-            return []
+            logging.debug("  > Error creating job for '%s': %s", target_name, e)
+            return None
 
-        # 2. Poll for Job Completion
-        while status not in ["finished", "errored"]:
-            time.sleep(2) # Be kind to the API, wait before checking again
-            try:
-                logging.debug(f"  > Requesting URL: {job_url}")
-                response = requests.get(job_url, headers=self.headers, params={'version': self.api_version}, allow_redirects=False)            
-                response.raise_for_status()
-                response_data = response.json()
-                logging.debug(f"  > Response data: {response_data}")
-                
-                status = response_data['data']['attributes']['status']
-                logging.debug(f"  > Polling... status is now: {status}")
-            except requests.exceptions.RequestException as e:
-                logging.debug(f"  > Error polling job for '{target_name}': {e}", file=sys.stderr)
-                return []
+        job = {'target': target, 'name': target_name, 'url': job_url, 'status': status, 'delay': POLL_INITIAL_DELAY}
+        self._schedule_poll(job, response)
+        return job
 
-        if status == "errored":
-            print(f"  > Job failed for '{target_name}'.", file=sys.stderr)
-            return []
+    def _schedule_poll(self, job, response):
+        """Sets when a job should next be polled, backing off exponentially (with jitter)."""
+        wait = _retry_after(response)
+        if wait is None:
+            delay = job['delay']
+            wait = delay + random.uniform(0, delay * 0.1)
+            job['delay'] = min(delay * 2, POLL_MAX_DELAY)
+        job['next_poll'] = time.monotonic() + wait
 
-        # 3. Get the final AI-BOM and search for the keyword
-        # Note that the job_url redirects to the bom get url when it is finished
-        # {self.api_url}/rest/orgs/{self.org_id}/ai_boms/{bom_id}?version={self.api_version}
+    def poll_job_once(self, job):
+        """
+        Checks the status of an AI-BOM job once and schedules its next poll.
+        
+        Returns:
+            str: The job status, or None if it couldn't be fetched (the job is then given up on).
+        """
         try:
-            logging.debug(f"  > Requesting final BOM URL: {job_url}")
-            final_response = requests.get(job_url, headers=self.headers, params={'version': self.api_version}, allow_redirects=True)
-            final_response.raise_for_status()
-            logging.debug(f"  > Final BOM response: {final_response.json()}")
+            logging.debug("  > Requesting URL: %s", job['url'])
+            response = self.session.get(job['url'], params={'version': self.api_version}, allow_redirects=False)
+            response.raise_for_status()
+            response_data = _parse_json(response)
+            logging.debug("  > Response data: %s", response_data)
+            
+            job['status'] = response_data['data']['attributes']['status']
+            logging.debug("  > Polling... status is now: %s", job['status'])
+            
+            # A finished job redirects to its AI-BOM; remember where so fetching it takes one request
+            location = response.headers.get('Location')
+            if job['status'] == "finished" and location:
+                job['bom_url'] = urljoin(job['url'], location)
+        except requests.exceptions.RequestException as e:
+            logging.debug("  > Error polling job for '%s': %s", job['name'], e)
+            job['status'] = None
+            return None
+
+        self._schedule_poll(job, response)
+        return job['status']
+
+    def wait_for_jobs(self, jobs, executor=None):
+        """
+        Polls AI-BOM jobs round-robin until every one of them has finished or failed.
+        
+        Each job keeps its own backoff, so every pass only polls the jobs that are due.
+        The polls of a pass are spread over the executor when one is given.
+        
+        Returns:
+            list: The jobs that finished successfully, in their original order.
+        """
+        poll = executor.map if executor else map
+        pending = [job for job in jobs if job['status'] not in (None, "finished", "errored")]
+        while pending:
+            time.sleep(max(min(job['next_poll'] for job in pending) - time.monotonic(), 0))
+            now = time.monotonic()
+            list(poll(self.poll_job_once, [job for job in pending if job['next_poll'] <= now]))
+            pending = [job for job in pending if job['status'] not in (None, "finished", "errored")]
 
-            bom_content = final_response.text
+        finished_jobs = []
+        for job in jobs:
+            if job['status'] == "finished":
+                finished_jobs.append(job)
+            elif job['status'] == "errored":
+                logging.warning("  > Job failed for '%s'.", job['name'])
+        return finished_jobs
+
+    def fetch_final_bom(self, job, search_terms):
+        """
+        Fetches the AI-BOM of a finished job and searches it for the terms from parse_search_terms().
+        
+        Returns:
+            list: List of matched search terms, or empty list if no matches found.
+        """
+        target_name = job['name']
+
+        # Note that the job url redirects to the bom get url when it is finished
+        # {self.api_url}/rest/orgs/{self.org_id}/ai_boms/{bom_id}?version={self.api_version}
+        # so go straight there when the last poll told us where it is
+        bom_url = job.get('bom_url', job['url'])
+        params = None if 'version=' in bom_url else {'version': self.api_version}
+        try:
+            logging.debug("  > Requesting final BOM URL: %s", bom_url)
             
-            # Split search terms by comma and check for matches
-            search_terms = [term.strip().lower() for term in search_keyword.split(',')]
-            bom_content_lower = bom_content.lower()
+            # Stream the BOM and stop downloading as soon as every term has been seen
+            with self.session.get(bom_url, params=params, allow_redirects=True, stream=True) as final_response:
+                final_response.raise_for_status()
+                found = _find_terms(final_response.iter_content(chunk_size=BOM_CHUNK_SIZE), search_terms)
             
             matched_terms = []
             for term in search_terms:
-                if term in bom_content_lower:
-                    logging.debug(f"  > Term '{term}' found in BOM content.")
-                    matched_terms.append(term)
+                if term in found:
+                    matched_terms.append(term.decode('utf-8'))
+                    logging.debug("  > Term '%s' found in BOM content.", matched_terms[-1])
             
             if matched_terms:
-                logging.debug(f"  > Found terms: {matched_terms}")
-            else:
-                logging.debug(f"  > None of the terms {search_terms} found in BOM content.")
+                logging.debug("  > Found terms: %s", matched_terms)
+            elif logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("  > None of the terms %s found in BOM content.", [term.decode('utf-8') for term in search_terms])
             
             return matched_terms
                 
         except requests.exceptions.RequestException as e:
-            logging.debug(f"  > Error fetching final BOM for '{target_name}': {e}", file=sys.stderr)
+            logging.debug("  > Error fetching final BOM for '%s': %s", target_name, e)
             return []
 
+    def process_target(self, search_keyword, target):
+        """
+        Generates and searches an AI-BOM for a single target.
+        
+        Returns:
+            list: List of matched search terms, or empty list if no matches found.
+        """
+        job = self.create_bom_job(target)
+        if job is None or not self.wait_for_jobs([job]):
+            return []
+        return self.fetch_final_bom(job, parse_search_terms(search_keyword))
+
 
 # --- Main Execution ---
+def scan(scanner, search_keyword, concurrency=DEFAULT_CONCURRENCY):
+    """Scans every supported target in the organization and prints a report."""
+    # Parse the terms once for the whole scan (and its report) rather than once per target
+    search_terms = parse_search_terms(search_keyword)
+    if not search_terms:
+        print("Error: Please provide at least one search term.", file=sys.stderr)
+        sys.exit(1)
+    
+    # Format the search terms for display
+    display_terms = [term.decode('utf-8') for term in search_terms]
+    if len(display_terms) == 1:
+        search_display = f"'{display_terms[0]}'"
+    else:
+        terms_formatted = ', '.join(f"'{term}'" for term in display_terms)
+        search_display = f"any of: {terms_formatted}"
+    
+    print(f"Starting scan to find targets using {search_display}...")
+    
+    target_count = 0
+    
+    def supported_targets():
+        nonlocal target_count
+        for target in scanner.iter_all_targets():
+            integration_type = _integration_type(target)
+            # The API already filters on this; keep the check in case a target slips through
+            if integration_type in SUPPORTED_INTEGRATION_TYPES:
+                target_count += 1
+                yield target
+            elif logging.getLogger().isEnabledFor(logging.DEBUG):
+                # Skip other target types like container images or manual uploads
+                target_name = target['attributes'].get('display_name', 'Unknown Name')
+                logging.debug("Skipping Target: %s (Integration: %s)", target_name, integration_type)
+    
+    # The three phases are pipelined across targets: every job is created up front so
+    # Snyk builds the AI-BOMs side by side, then they are polled together and fetched
+    create_futures = []
+    futures = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            # 1. Create the AI-BOM jobs, starting on each page of targets as soon as it arrives
+            for target in supported_targets():
+                create_futures.append(executor.submit(scanner.create_bom_job, target))
+            jobs = [job for job in (future.result() for future in create_futures) if job]
+        
+            if not target_count:
+                # The API filters on integration type, so an empty listing is only an error if a page failed
+                if scanner.targets_incomplete:
+                    print("Could not retrieve any targets. Exiting.", file=sys.stderr)
+                    sys.exit(1)
+                print("No supported targets found in the organization.")
+            else:
+                print(f"Found {target_count} supported targets in the organization.")
+        
+            # 2. Poll the jobs round-robin until they are done
+            finished_jobs = scanner.wait_for_jobs(jobs, executor)
+        
+            # 3. Get the final AI-BOMs and search them for the keyword, formatting each
+            # match's report line as it comes in
+            report_lines = [None] * len(finished_jobs)
+            futures = {
+                executor.submit(scanner.fetch_final_bom, job, search_terms): index
+                for index, job in enumerate(finished_jobs)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                matched_terms = future.result()
+                if matched_terms:
+                    target = finished_jobs[index]['target']
+                    target_name = target['attributes'].get('display_name', target['id'])
+                    terms_str = ','.join(matched_terms)
+                    report_lines[index] = f"   • {target_name} ({terms_str})"
+                    logging.info("  ✅ FOUND match in %s!", target_name)
+        except KeyboardInterrupt:
+            # Drop the requests still queued so leaving the pool only waits for those in flight
+            # (executor.map in wait_for_jobs cancels its own futures when interrupted)
+            for future in create_futures + list(futures):
+                future.cancel()
+            raise
+    
+    # Report matches in target order regardless of completion order
+    report_lines = [line for line in report_lines if line]
+
+    # --- Final Report ---
+    # Assembled up front and written with a single print
+    if scanner.targets_incomplete:
+        report = ["Scan Complete (incomplete: target listing failed)", "=" * 50]
+    else:
+        report = ["Scan Complete", "=" * 50]
+    
+    if report_lines:
+        match_count = len(report_lines)
+        target_word = "target" if match_count == 1 else "targets"
+        
+        report.append(f"✅ Found matches in {match_count} {target_word}:")
+        report.extend(report_lines)
+    else:
+        report.append(f"ℹ️  No matches for {search_display} found in any scanned target.")
+    
+    report.append("=" * 50)
+    print("\n".join(report))
+    
+    # Not every target was scanned, so the absence of a match proves nothing
+    if scanner.targets_incomplete:
+        print("Error: Could not retrieve all targets; the scan results are incomplete.", file=sys.stderr)
+        sys.exit(1)
+
+
 def main():
     """Main entry point for the console script."""
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Scan Snyk organization targets for AI-BOM keywords")
     parser.add_argument("search_keyword", help="The keyword(s) to search for in the AI-BOM (comma-separated for multiple terms)")
     parser.add_argument("--debug", action="store_true", help="Enable debug output")
+    parser.add_argument(
+        "--concurrency",
+        type=_positive_int,
+        default=os.getenv("SNYK_SCAN_CONCURRENCY", DEFAULT_CONCURRENCY),
+        help=f"Number of targets to process concurrently (default: $SNYK_SCAN_CONCURRENCY or {DEFAULT_CONCURRENCY})",
+    )
     args = parser.parse_args()
     
     # Setup logging
@@ -169,61 +495,8 @@ def main():
         sys.exit(1)
     
     # Setup API components
-    scanner = SnykAIBomScanner(SNYK_API_URL, SNYK_ORG_ID, SNYK_TOKEN)
-    
-    search_keyword = args.search_keyword
-    
-    # Format the search terms for display
-    search_terms_display = [term.strip() for term in search_keyword.split(',')]
-    if len(search_terms_display) == 1:
-        search_display = f"'{search_terms_display[0]}'"
-    else:
-        terms_formatted = ', '.join([f"'{term}'" for term in search_terms_display])
-        search_display = f"any of: {terms_formatted}"
-    
-    print(f"Starting scan to find targets using {search_display}...")
-    
-    all_targets = scanner.get_all_targets()
-    
-    if not all_targets:
-        print("Could not retrieve any targets. Exiting.", file=sys.stderr)
-        sys.exit(1)
-        
-    print(f"Found {len(all_targets)} total targets in the organization.")
-    
-    found_in_targets = []
-    
-    for target in all_targets:
-        # Get integration type from the nested structure
-        integration_type = target.get('relationships', {}).get('integration', {}).get('data', {}).get('attributes', {}).get('integration_type')
-        if integration_type in ['github', 'github-enterprise', 'gitlab', 'azure-repos', 'bitbucket-cloud']:
-            # We now call our complete function from steps 3 & 4
-            matched_terms = scanner.process_target(search_keyword, target)
-            if matched_terms: 
-                target_name = target['attributes'].get('display_name', target['id'])
-                found_in_targets.append({'name': target_name, 'terms': matched_terms})
-                print(f"  ✅ FOUND match in {target_name}!")
-        else:
-            # Skip other target types like container images or manual uploads
-            target_name = target['attributes'].get('display_name', 'Unknown Name')
-            logging.debug(f"Skipping Target: {target_name} (Integration: {integration_type})")
-
-    # --- Final Report ---
-    print("Scan Complete")
-    print("=" * 50)
-    
-    if found_in_targets:
-        target_count = len(found_in_targets)
-        target_word = "target" if target_count == 1 else "targets"
-        
-        print(f"✅ Found matches in {target_count} {target_word}:")
-        for target in found_in_targets:
-            terms_str = ','.join(target['terms'])
-            print(f"   • {target['name']} ({terms_str})")
-    else:
-        print(f"ℹ️  No matches for {search_display} found in any scanned target.")
-    
-    print("=" * 50)
+    with SnykAIBomScanner(SNYK_API_URL, SNYK_ORG_ID, SNYK_TOKEN, concurrency=args.concurrency) as scanner:
+        scan(scanner, args.search_keyword, concurrency=args.concurrency)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file